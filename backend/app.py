@@ -1,44 +1,120 @@
 import os
+
+# CPU pinning (Linux only): model loads and batcher threads keep TensorFlow on all but
+# the last available core. The dev server also keeps its request/I/O threads on that
+# last core; gunicorn workers' request threads may use every core. Nothing is pinned
+# at import, so scripts importing this module keep every core. Set PIN_CPUS=0 to disable.
+AVAILABLE_CPUS = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+if os.environ.get('PIN_CPUS', '1') == '1' and len(AVAILABLE_CPUS) > 1:
+    COMPUTE_CPUS = set(AVAILABLE_CPUS[:-1])
+    IO_CPUS = {AVAILABLE_CPUS[-1]}
+else:
+    COMPUTE_CPUS = IO_CPUS = None
+NUM_COMPUTE_CPUS = len(COMPUTE_CPUS) if COMPUTE_CPUS else os.cpu_count()
+
+# Every gunicorn worker runs its own TensorFlow runtime and decode pool, so the
+# default pool sizes split the cores between workers (see gunicorn.conf.py)
+NUM_SERVER_WORKERS = max(1, int(os.environ.get('GUNICORN_WORKERS', 1)))
+COMPUTE_THREADS_PER_WORKER = max(1, NUM_COMPUTE_CPUS // NUM_SERVER_WORKERS)
+
+def pin_current_thread(cpus):
+    """Restrict the calling thread, and threads it starts afterwards, to `cpus`.
+    
+    Returns the thread's previous CPU set (None when pinning is disabled).
+    """
+    if cpus:
+        previous_cpus = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, cpus)
+        return previous_cpus
+    return None
+
+# CPU threading knobs (oneDNN / OpenMP) must be set before TensorFlow is imported
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')
+os.environ.setdefault('OMP_NUM_THREADS', str(COMPUTE_THREADS_PER_WORKER))
+os.environ.setdefault('KMP_BLOCKTIME', '1')
+os.environ.setdefault('KMP_AFFINITY', 'granularity=fine,compact,1,0')
+
 import numpy as np
 import json
-from flask import Flask, request, jsonify, send_file
+import orjson
+import multiprocessing
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
 import tensorflow as tf
 from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
-from PIL import Image
-import io
 import base64
 import logging
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-# Model-specific preprocessing
-from tensorflow.keras.applications.vgg16 import preprocess_input as vgg_preprocess
+from preprocessing import decode_and_preprocess
+
+# Optional INT8 CPU runtime (see optimize_models.py)
+try:
+    import openvino as ov
+except ImportError:
+    ov = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Prediction-Index'])
 
 # Configuration
-UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff'}
 
 # Model paths
 CNN_MODEL_PATH = 'models/cervical_cancer_cnn_results/cnn_cervical_cancer_model.h5'
+CNN_TFLITE_PATH = 'models/cervical_cancer_cnn_results/cnn_int8.tflite'
 VGG16_MODEL_PATH = 'models/cervical_cancer_vgg16_results/vgg16_cervical_cancer_model.h5'
+VGG16_OPENVINO_PATH = 'models/cervical_cancer_vgg16_results/vgg16_int8.xml'
+VGG16_SAVED_MODEL_PATH = 'models/cervical_cancer_vgg16_results/vgg16_saved_model'
+VGG16_FP16_SAVED_MODEL_PATH = 'models/cervical_cancer_vgg16_results/vgg16_fp16_saved_model'
+VGG16_TFLITE_PATH = 'models/cervical_cancer_vgg16_results/vgg16_int8.tflite'
+VGG16_PRUNED_OPENVINO_PATH = 'models/cervical_cancer_vgg16_results/vgg16_pruned_int8.xml'
+VGG16_PRUNED_TFLITE_PATH = 'models/cervical_cancer_vgg16_results/vgg16_pruned_int8.tflite'
+
+# The INT8 TFLite models replace the Keras models only when explicitly enabled
+USE_CNN_TFLITE = os.environ.get('USE_CNN_TFLITE', '0') == '1'
+USE_VGG16_TFLITE = os.environ.get('USE_VGG16_TFLITE', '0') == '1'
+
+# The pruned VGG16 (conv backbone + small head) replaces the full model only when
+# explicitly enabled; check vgg16_pruned_evaluation_metrics.json first
+USE_PRUNED_VGG16 = os.environ.get('USE_PRUNED_VGG16', '0') == '1'
 
 # Metrics paths
 CNN_METRICS_PATH = 'models/cervical_cancer_cnn_results/cnn_evaluation_metrics.json'
 VGG16_METRICS_PATH = 'models/cervical_cancer_vgg16_results/vgg16_evaluation_metrics.json'
+VGG16_PRUNED_METRICS_PATH = 'models/cervical_cancer_vgg16_results/vgg16_pruned_evaluation_metrics.json'
+
+# Micro-batching configuration (mirrors TF-Serving batching_parameters)
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 8))
+BATCH_TIMEOUT_MICROS = int(os.environ.get('BATCH_TIMEOUT_MICROS', 5000))
+NUM_BATCH_THREADS = int(os.environ.get('NUM_BATCH_THREADS', 1))
+PREDICT_TIMEOUT_SECONDS = float(os.environ.get('PREDICT_TIMEOUT_SECONDS', 30))
+DECODE_TIMEOUT_SECONDS = float(os.environ.get('DECODE_TIMEOUT_SECONDS', 10))
+
+# Number of distinct uploads whose predictions are kept in memory
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 512))
+
+# Processes used to decode/resize uploads off the request threads (0 disables the pool)
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', max(1, (os.cpu_count() - 1) // NUM_SERVER_WORKERS)))
+
+# TensorFlow thread pools
+INTRA_OP_THREADS = int(os.environ.get('INTRA_OP_THREADS', COMPUTE_THREADS_PER_WORKER))
+INTER_OP_THREADS = int(os.environ.get('INTER_OP_THREADS', 2))
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
 # Create directories
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs('models', exist_ok=True)
 os.makedirs('models/cervical_cancer_cnn_results', exist_ok=True)
 os.makedirs('models/cervical_cancer_vgg16_results', exist_ok=True)
@@ -54,7 +130,27 @@ CLASS_NAMES = [
 # Global model variables
 cnn_model = None
 vgg16_model = None
+cnn_infer_fn = None  # Traced inference callables, built alongside each model
+vgg16_infer_fn = None
+# One lock per model so a slow VGG16 load does not block CNN traffic
+model_load_locks = {'cnn': threading.Lock(), 'vgg16': threading.Lock()}
 vgg16_is_saved_model = False  # Flag to track if VGG16 is a SavedModel
+vgg16_is_pruned = False  # Flag to track if VGG16 is the pruned-head model
+vgg16_input_dtype = np.float32  # float16 when serving the mixed-precision SavedModel
+tf_threading_configured = False
+
+def configure_tf_threading():
+    """Size TensorFlow's thread pools; only takes effect before the runtime is initialized"""
+    global tf_threading_configured
+    if tf_threading_configured:
+        return
+    tf_threading_configured = True
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(INTRA_OP_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(INTER_OP_THREADS)
+        logger.info(f"TensorFlow threading: intra_op={INTRA_OP_THREADS}, inter_op={INTER_OP_THREADS}")
+    except RuntimeError as e:
+        logger.warning(f"Could not configure TensorFlow threading: {str(e)}")
 
 class SavedModelWrapper:
     """Wrapper class to make SavedModel behave like a Keras model"""
@@ -62,131 +158,361 @@ class SavedModelWrapper:
         self.saved_model = saved_model
         self.signature = saved_model.signatures[signature_name]
         
-        # Extract input and output keys from signature
-        try:
-            # Get input signature (usually in structured_input_signature[1])
-            sig_input = self.signature.structured_input_signature
-            if isinstance(sig_input, tuple) and len(sig_input) > 1:
-                self.input_key = list(sig_input[1].keys())[0]
-            else:
-                # Fallback: try to get from function args
-                self.input_key = list(sig_input.keys())[0] if isinstance(sig_input, dict) else 'input_1'
-        except Exception as e:
-            logger.warning(f"Could not determine input key from signature: {e}, using default")
-            self.input_key = 'input_1'
+        # Resolve the single input/output once (see `optimize_models.py saved-model`)
+        # instead of inspecting the signature on every call
+        input_specs = self.signature.structured_input_signature[1]
+        self.input_key, input_spec = next(iter(input_specs.items()))
+        self.input_dtype = input_spec.dtype  # float16 for the mixed-precision export
+        self.output_key = next(iter(self.signature.structured_outputs))
+    
+    def predict(self, x, verbose=0):
+        """Predict method compatible with Keras model.predict()"""
+        output = self.signature(**{self.input_key: tf.constant(x, dtype=self.input_dtype)})
+        return output[self.output_key].numpy()
+
+class OpenVINOModelWrapper:
+    """Wrapper class to make an OpenVINO compiled model behave like a Keras model"""
+    def __init__(self, compiled_model):
+        self.compiled_model = compiled_model
+        self.output = compiled_model.output(0)
+        # Calling a CompiledModel reuses one infer request, so serialize access
+        self.lock = threading.Lock()
+    
+    def predict(self, x, verbose=0):
+        """Predict method compatible with Keras model.predict()"""
+        with self.lock:
+            return self.compiled_model([x])[self.output]
+
+class TFLiteModelWrapper:
+    """Wrapper class to make a (quantized) TFLite interpreter behave like a Keras model"""
+    def __init__(self, model_path, num_threads=INTRA_OP_THREADS, batch_size=MAX_BATCH_SIZE):
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        # Plan memory once for a fixed batch size: resizing re-prepares the graph, so
+        # smaller batches are padded instead
+        input_details = self.interpreter.get_input_details()[0]
+        self.interpreter.resize_tensor_input(input_details['index'], [batch_size, *input_details['shape'][1:]])
+        self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self.input_buffer = np.zeros(self.input_details['shape'], dtype=self.input_details['dtype'])
+        # The interpreter holds mutable state, so serialize access
+        self.lock = threading.Lock()
+    
+    def _quantize(self, x):
+        """Map float input onto the interpreter's integer input, if it has one"""
+        dtype = self.input_details['dtype']
+        scale, zero_point = self.input_details['quantization']
+        if not scale:
+            return x.astype(dtype, copy=False)
+        info = np.iinfo(dtype)
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(dtype)
+    
+    def _dequantize(self, y):
+        scale, zero_point = self.output_details['quantization']
+        if not scale:
+            return y.astype(np.float32, copy=False)
+        return (y.astype(np.float32) - zero_point) * scale
     
     def predict(self, x, verbose=0):
         """Predict method compatible with Keras model.predict()"""
+        outputs = []
+        with self.lock:
+            for start in range(0, len(x), self.batch_size):
+                chunk = self._quantize(x[start:start + self.batch_size])
+                # Rows past the chunk keep stale input; their outputs are sliced off
+                self.input_buffer[:len(chunk)] = chunk
+                self.interpreter.set_tensor(self.input_details['index'], self.input_buffer)
+                self.interpreter.invoke()
+                output = self.interpreter.get_tensor(self.output_details['index'])[:len(chunk)]
+                outputs.append(self._dequantize(output))
+        return np.concatenate(outputs, axis=0)
+
+def build_infer_fn(model):
+    """Return a numpy-in/numpy-out inference callable for the loaded model"""
+    if not isinstance(model, tf.keras.Model):
+        # Wrappers already call a compiled signature/runtime directly
+        return lambda x: model.predict(x, verbose=0)
+    
+    # Trace once for a fixed signature to skip Keras' per-call predict() dispatch
+    concrete_fn = tf.function(
+        lambda x: model(x, training=False),
+        input_signature=[tf.TensorSpec([None, 224, 224, 3], tf.float32)]
+    ).get_concrete_function()
+    return lambda x: concrete_fn(tf.constant(x)).numpy()
+
+def prepare_inference(model, model_name, dtype=np.float32, input_shape=(1, 224, 224, 3)):
+    """Build the model's inference callable and warm it up before the first request"""
+    # Tracing errors propagate so the caller can fall back to the next model source
+    infer_fn = build_infer_fn(model)
+    try:
+        dummy = np.zeros(input_shape, dtype=dtype)
+        _ = infer_fn(dummy)
+        logger.info(f"{model_name} warmup complete")
+    except Exception as e:
+        logger.warning(f"{model_name} warmup failed: {str(e)}")
+    return infer_fn
+
+def load_saved_model(path):
+    """Load a SavedModel directory and wrap its serving signature"""
+    saved_model_obj = tf.saved_model.load(path)
+    
+    # Use 'serving_default' if available, otherwise use the first signature
+    signatures = list(saved_model_obj.signatures.keys())
+    logger.info(f"Available signatures: {signatures}")
+    signature_name = 'serving_default' if 'serving_default' in signatures else signatures[0]
+    return SavedModelWrapper(saved_model_obj, signature_name=signature_name)
+
+def cnn_sources():
+    """CNN artifacts in order of preference: (description, available, loader, input dtype)"""
+    return [
+        ('INT8 TFLite model', USE_CNN_TFLITE and os.path.exists(CNN_TFLITE_PATH),
+         lambda: TFLiteModelWrapper(CNN_TFLITE_PATH), np.float32),
+        # Try loading with compile=False first to avoid compilation issues
+        ('.h5 file (without compilation)', os.path.exists(CNN_MODEL_PATH),
+         lambda: load_model(CNN_MODEL_PATH, compile=False), np.float32),
+        ('.h5 file (with compilation)', os.path.exists(CNN_MODEL_PATH),
+         lambda: load_model(CNN_MODEL_PATH, compile=True), np.float32),
+    ]
+
+def vgg16_sources():
+    """VGG16 artifacts in order of preference: (description, available, loader, input dtype)"""
+    has_gpu = bool(tf.config.list_physical_devices('GPU'))
+    return [
+        # Pruned-head INT8 models produced by `optimize_models.py prune-head`
+        ('pruned INT8 OpenVINO IR', USE_PRUNED_VGG16 and ov is not None and os.path.exists(VGG16_PRUNED_OPENVINO_PATH),
+         lambda: OpenVINOModelWrapper(ov.Core().compile_model(VGG16_PRUNED_OPENVINO_PATH, "CPU")), np.float32),
+        ('pruned INT8 TFLite model', USE_PRUNED_VGG16 and os.path.exists(VGG16_PRUNED_TFLITE_PATH),
+         lambda: TFLiteModelWrapper(VGG16_PRUNED_TFLITE_PATH), np.float32),
+        # FP16 only pays off on GPU tensor cores
+        ('FP16 SavedModel (mixed precision)', has_gpu and os.path.exists(VGG16_FP16_SAVED_MODEL_PATH),
+         lambda: load_saved_model(VGG16_FP16_SAVED_MODEL_PATH), np.float16),
+        # The INT8 runtimes are CPU-only; on a GPU host they would move serving off the GPU
+        ('INT8 OpenVINO IR', not has_gpu and ov is not None and os.path.exists(VGG16_OPENVINO_PATH),
+         lambda: OpenVINOModelWrapper(ov.Core().compile_model(VGG16_OPENVINO_PATH, "CPU")), np.float32),
+        ('INT8 TFLite model', not has_gpu and USE_VGG16_TFLITE and os.path.exists(VGG16_TFLITE_PATH),
+         lambda: TFLiteModelWrapper(VGG16_TFLITE_PATH), np.float32),
+        # tf.saved_model.load works for Keras 3 exports too
+        ('saved_model directory', os.path.exists(VGG16_SAVED_MODEL_PATH),
+         lambda: load_saved_model(VGG16_SAVED_MODEL_PATH), np.float32),
+        ('.h5 file (without compilation)', os.path.exists(VGG16_MODEL_PATH),
+         lambda: load_model(VGG16_MODEL_PATH, compile=False), np.float32),
+        ('.h5 file (with compilation)', os.path.exists(VGG16_MODEL_PATH),
+         lambda: load_model(VGG16_MODEL_PATH, compile=True), np.float32),
+    ]
+
+def load_first_available(model_name, sources):
+    """Load the first available source; returns (model, infer_fn, input_dtype, description)"""
+    for description, available, loader, input_dtype in sources:
+        if not available:
+            continue
         try:
-            # Convert numpy array to tensor if needed
-            if isinstance(x, np.ndarray):
-                x = tf.constant(x, dtype=tf.float32)
-            
-            # Call the signature with the input
-            output = self.signature(**{self.input_key: x})
-            
-            # Get the output (usually the first output or 'output_0')
-            if isinstance(output, dict):
-                output_key = list(output.keys())[0]
-                predictions = output[output_key].numpy()
-            else:
-                # If output is a single tensor
-                predictions = output.numpy()
-            
-            return predictions
+            logger.info(f"Attempting to load {model_name} from {description}...")
+            model = loader()
+            infer_fn = prepare_inference(model, model_name, dtype=input_dtype)
         except Exception as e:
-            logger.error(f"Error in SavedModelWrapper.predict: {str(e)}")
-            # Try alternative method: call directly without keyword
-            try:
-                output = self.signature(x)
-                if isinstance(output, dict):
-                    predictions = list(output.values())[0].numpy()
-                else:
-                    predictions = output.numpy()
-                return predictions
-            except Exception as e2:
-                logger.error(f"Alternative prediction method also failed: {str(e2)}")
-                raise
+            logger.warning(f"Error loading {model_name} from {description}: {str(e)}")
+            continue
+        logger.info(f"{model_name} model loaded successfully from {description}")
+        return model, infer_fn, input_dtype, description
+    
+    # If all sources failed, raise an error
+    tried = ', '.join(description for description, available, _, _ in sources if available)
+    error_msg = f"Failed to load {model_name} model. Tried: {tried or 'no model files found'}."
+    logger.error(error_msg)
+    raise RuntimeError(error_msg)
 
 def load_cnn_model():
-    global cnn_model
+    global cnn_model, cnn_infer_fn
     if cnn_model is None:
-        try:
-            # Try loading with compile=False first to avoid compilation issues
-            cnn_model = load_model(CNN_MODEL_PATH, compile=False)
-            logger.info("CNN model loaded successfully")
-        except Exception as e:
-            logger.error(f"Error loading CNN model: {str(e)}")
-            # Try loading with compile=True as fallback
-            try:
-                cnn_model = load_model(CNN_MODEL_PATH, compile=True)
-                logger.info("CNN model loaded successfully (with compile=True)")
-            except Exception as e2:
-                logger.error(f"Error loading CNN model with compile=True: {str(e2)}")
-                raise
+        configure_tf_threading()
+        model, infer_fn, _, _ = load_first_available('CNN', cnn_sources())
+        # Publish the model last: get_model checks it without taking the lock
+        cnn_infer_fn = infer_fn
+        cnn_model = model
     return cnn_model
 
 def load_vgg16_model():
-    global vgg16_model, vgg16_is_saved_model
+    global vgg16_model, vgg16_infer_fn, vgg16_is_saved_model, vgg16_is_pruned, vgg16_input_dtype
     if vgg16_model is None:
-        saved_model_path = 'models/cervical_cancer_vgg16_results/vgg16_saved_model'
-        h5_model_path = VGG16_MODEL_PATH
-        
-        # Method 1: Try loading from saved_model directory using tf.saved_model.load (for Keras 3)
-        if os.path.exists(saved_model_path):
+        configure_tf_threading()
+        model, infer_fn, input_dtype, source = load_first_available('VGG16', vgg16_sources())
+        # Publish the model last: get_model checks it without taking the lock
+        vgg16_infer_fn = infer_fn
+        vgg16_input_dtype = input_dtype
+        vgg16_is_saved_model = isinstance(model, SavedModelWrapper)
+        vgg16_is_pruned = source.startswith('pruned')
+        vgg16_model = model
+    return vgg16_model
+
+class PredictionBatcher:
+    """Groups concurrent prediction requests into a single model inference call"""
+    def __init__(self, model_type, max_batch_size=MAX_BATCH_SIZE,
+                 batch_timeout_micros=BATCH_TIMEOUT_MICROS, num_batch_threads=NUM_BATCH_THREADS):
+        self.model_type = model_type
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout_micros / 1e6
+        self.requests = queue.Queue()
+        self.threads = []
+        for i in range(num_batch_threads):
+            thread = threading.Thread(
+                target=self._worker,
+                name=f"{model_type}-batcher-{i}",
+                daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+    
+    def submit(self, img_array):
+        """Queue a preprocessed (1, H, W, C) array and return a Future for its prediction row"""
+        future = Future()
+        self.requests.put((img_array, future))
+        return future
+    
+    def _collect_batch(self):
+        """Block for the first request, then drain until the batch is full or the timeout expires"""
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
             try:
-                logger.info("Attempting to load VGG16 from saved_model directory using tf.saved_model.load...")
-                saved_model_obj = tf.saved_model.load(saved_model_path)
-                
-                # Check available signatures
-                signatures = list(saved_model_obj.signatures.keys())
-                logger.info(f"Available signatures: {signatures}")
-                
-                # Use 'serving_default' if available, otherwise use the first signature
-                signature_name = 'serving_default' if 'serving_default' in signatures else signatures[0]
-                
-                # Wrap the SavedModel to make it compatible with Keras model interface
-                vgg16_model = SavedModelWrapper(saved_model_obj, signature_name=signature_name)
-                vgg16_is_saved_model = True
-                logger.info(f"VGG16 model loaded successfully from saved_model directory (using signature: {signature_name})")
-                return vgg16_model
-            except Exception as e1:
-                logger.warning(f"Error loading from saved_model directory: {str(e1)}")
-        
-        # Method 2: Try loading from .h5 file with compile=False
-        if os.path.exists(h5_model_path):
+                if remaining > 0:
+                    batch.append(self.requests.get(timeout=remaining))
+                else:
+                    batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    def _worker(self):
+        # Started from a request thread, so move back onto the compute cores
+        pin_current_thread(COMPUTE_CPUS)
+        while True:
+            batch = self._collect_batch()
+            # Skip requests whose caller already gave up
+            pending = [(img_array, future) for img_array, future in batch
+                       if future.set_running_or_notify_cancel()]
+            if not pending:
+                continue
+            arrays, futures = zip(*pending)
             try:
-                logger.info("Attempting to load VGG16 from .h5 file...")
-                vgg16_model = load_model(h5_model_path, compile=False)
-                vgg16_is_saved_model = False
-                logger.info("VGG16 model loaded successfully from .h5 file (without compilation)")
-                return vgg16_model
-            except Exception as e2:
-                logger.warning(f"Error loading VGG16 .h5 with compile=False: {str(e2)}")
-                # Try with compile=True as last resort
-                try:
-                    vgg16_model = load_model(h5_model_path, compile=True)
-                    vgg16_is_saved_model = False
-                    logger.info("VGG16 model loaded successfully from .h5 file (with compilation)")
-                    return vgg16_model
-                except Exception as e3:
-                    logger.error(f"Error loading VGG16 .h5 with compile=True: {str(e3)}")
-        
-        # If all methods failed, raise an error
-        error_msg = "Failed to load VGG16 model. Tried saved_model directory and .h5 file."
-        logger.error(error_msg)
-        raise RuntimeError(error_msg)
+                infer_fn = get_infer_fn(self.model_type)
+                predictions = infer_fn(np.concatenate(arrays, axis=0))
+                for future, row in zip(futures, predictions):
+                    future.set_result(row)
+            except Exception as e:
+                logger.error(f"Batch prediction error ({self.model_type.upper()}): {str(e)}")
+                for future in futures:
+                    future.set_exception(e)
+
+# One batcher per model type, created on first use
+batchers = {}
+batchers_lock = threading.Lock()
+
+def get_batcher(model_type):
+    """Get (or lazily start) the batcher serving the given model type"""
+    with batchers_lock:
+        if model_type not in batchers:
+            batchers[model_type] = PredictionBatcher(model_type)
+        return batchers[model_type]
+
+class PredictionCache:
+    """Thread-safe bounded LRU of prediction rows keyed by (model_type, upload SHA-256)"""
+    def __init__(self, max_size=PREDICTION_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
     
-    return vgg16_model
+    def get(self, key):
+        with self.lock:
+            prediction = self.entries.get(key)
+            if prediction is not None:
+                self.entries.move_to_end(key)
+            return prediction
+    
+    def put(self, key, prediction):
+        with self.lock:
+            self.entries[key] = prediction
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+prediction_cache = PredictionCache()
+
+decode_pool = None
+decode_pool_lock = threading.Lock()
+
+def get_decode_pool():
+    """Get (or lazily start) the process pool used for image decoding"""
+    global decode_pool
+    with decode_pool_lock:
+        if decode_pool is None and DECODE_WORKERS > 0:
+            # Fork from a clean server process that has only imported preprocessing,
+            # so workers neither import TensorFlow nor inherit its thread pools.
+            # Workers also re-import the __main__ script, which is why the dev server
+            # is launched through serve.py (and `python app.py` disables the pool).
+            mp_context = multiprocessing.get_context('forkserver')
+            mp_context.set_forkserver_preload(['preprocessing'])
+            # Workers inherit the request thread's affinity (the I/O core under the dev
+            # server); let them use every core
+            initializer, initargs = (os.sched_setaffinity, (0, set(AVAILABLE_CPUS))) if IO_CPUS else (None, ())
+            decode_pool = ProcessPoolExecutor(max_workers=DECODE_WORKERS, mp_context=mp_context,
+                                              initializer=initializer, initargs=initargs)
+        return decode_pool
+
+def discard_decode_pool(pool):
+    """Drop a broken decode pool so the next request starts a fresh one"""
+    global decode_pool
+    with decode_pool_lock:
+        # Another request may already have replaced it
+        if decode_pool is pool:
+            decode_pool = None
+    pool.shutdown(wait=False)
+
+def decode_upload(buf, model_type, input_dtype):
+    """Decode and preprocess an upload in the decode pool (inline if the pool is disabled)"""
+    for attempt in range(2):
+        pool = get_decode_pool()
+        if pool is None:
+            return decode_and_preprocess(buf, model_type, input_dtype)
+        try:
+            future = pool.submit(decode_and_preprocess, buf, model_type, input_dtype)
+            return future.result(timeout=DECODE_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Image decoding timed out after {DECODE_TIMEOUT_SECONDS:g}s")
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed on a huge image); every later submit to this
+            # pool would fail, so replace it and retry once
+            logger.warning("Decode pool worker died; restarting the decode pool")
+            discard_decode_pool(pool)
+    raise RuntimeError("Image decoding failed: decode pool worker died")
+
+def get_infer_fn(model_type):
+    """Get the inference callable for a model type, loading the model if needed"""
+    get_model(model_type)
+    return cnn_infer_fn if model_type == 'cnn' else vgg16_infer_fn
 
 def get_model(model_type):
     """Get the appropriate model based on type"""
     if model_type == 'cnn':
-        return load_cnn_model()
+        model, loader = cnn_model, load_cnn_model
     elif model_type == 'vgg16':
-        return load_vgg16_model()
+        model, loader = vgg16_model, load_vgg16_model
     else:
         raise ValueError(f"Unknown model type: {model_type}")
+    
+    # Loaded models are returned without locking; only lazy loads are serialized
+    if model is not None:
+        return model
+    with model_load_locks[model_type]:
+        # Lazy loads run on a request thread; start the runtime's thread pools on the
+        # compute cores, then give the thread back its own affinity
+        previous_cpus = pin_current_thread(COMPUTE_CPUS)
+        try:
+            return loader()
+        finally:
+            pin_current_thread(previous_cpus)
 
 def load_metrics(model_type):
     """Load evaluation metrics from JSON file"""
@@ -194,7 +520,8 @@ def load_metrics(model_type):
         if model_type == 'cnn':
             metrics_path = CNN_METRICS_PATH
         elif model_type == 'vgg16':
-            metrics_path = VGG16_METRICS_PATH
+            # Report the pruned head's own validation metrics while it is serving
+            metrics_path = VGG16_PRUNED_METRICS_PATH if vgg16_is_pruned else VGG16_METRICS_PATH
         else:
             return None
         
@@ -212,80 +539,128 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def preprocess_image(img, model_type='vgg16', target_size=(224, 224)):
-    """Preprocess image based on model type"""
-    img = img.resize(target_size)
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    
-    if model_type == 'vgg16':
-        # VGG16 requires specific preprocessing
-        img_array = vgg_preprocess(img_array)
-    elif model_type == 'cnn':
-        # CNN typically uses normalization to [0, 1]
-        img_array = img_array / 255.0
-    else:
-        # Default normalization
-        img_array = img_array / 255.0
-    
-    return img_array
+# Second-precision ISO timestamp shared by all responses, refreshed by a background thread
+cached_timestamp = None
+clock_lock = threading.Lock()
 
-@app.route('/api/predict', methods=['POST'])
-def predict():
+def refresh_timestamp():
+    global cached_timestamp
+    while True:
+        cached_timestamp = datetime.now().isoformat(timespec='seconds')
+        time.sleep(1)
+
+def current_timestamp(exact=False):
+    """ISO timestamp to the second (up to 1 s old); exact=True gives the current time with microseconds"""
+    global cached_timestamp
+    if exact:
+        return datetime.now().isoformat()
+    if cached_timestamp is None:
+        # Started on first use so that, under gunicorn, the thread runs inside each worker
+        with clock_lock:
+            if cached_timestamp is None:
+                cached_timestamp = datetime.now().isoformat(timespec='seconds')
+                threading.Thread(target=refresh_timestamp, name='timestamp-clock', daemon=True).start()
+    return cached_timestamp
+
+def wants_exact_timestamp():
+    """Clients can opt into an exact timestamp with ?exact_timestamp=1"""
+    return request.args.get('exact_timestamp') == '1'
+
+def ojson(obj, status=200):
+    """Fast JSON response via orjson for the hot prediction path"""
+    return Response(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), status=status, mimetype='application/json')
+
+def validate_upload():
+    """Validate a prediction request; returns (file, model_type, error_response)"""
     if 'file' not in request.files:
-        return jsonify({'error': 'No file uploaded'}), 400
+        return None, None, (jsonify({'error': 'No file uploaded'}), 400)
     
     file = request.files['file']
     if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+        return None, None, (jsonify({'error': 'No file selected'}), 400)
     
     # Get model type from form data or default to 'vgg16'
     model_type = request.form.get('model_type', 'vgg16').lower()
     if model_type not in ['cnn', 'vgg16']:
-        return jsonify({'error': 'Invalid model type. Use "cnn" or "vgg16"'}), 400
+        return None, None, (jsonify({'error': 'Invalid model type. Use "cnn" or "vgg16"'}), 400)
     
-    if file and allowed_file(file.filename):
-        try:
-            # Load appropriate model
-            model = get_model(model_type)
-            
-            # Save uploaded file temporarily
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Read and preprocess image
-            img = Image.open(filepath).convert('RGB')
-            img_array = preprocess_image(img, model_type=model_type)
-            
-            # Make prediction
-            predictions = model.predict(img_array, verbose=0)
-            predicted_class_idx = np.argmax(predictions[0])
-            confidence = float(predictions[0][predicted_class_idx])
-            
-            # Clean up uploaded file
-            os.remove(filepath)
-            
-            # Prepare response
-            result = {
-                'prediction': CLASS_NAMES[predicted_class_idx],
-                'confidence': confidence,
-                'class_index': int(predicted_class_idx),
-                'model_type': model_type,
-                'timestamp': datetime.now().isoformat(),
-                'all_predictions': {
-                    CLASS_NAMES[i]: float(predictions[0][i]) for i in range(len(CLASS_NAMES))
-                }
-            }
-            
-            logger.info(f"Prediction ({model_type.upper()}): {result['prediction']} (Confidence: {confidence:.2f})")
-            return jsonify(result)
-            
-        except Exception as e:
-            logger.error(f"Prediction error: {str(e)}")
-            return jsonify({'error': 'Prediction failed: ' + str(e)}), 500
+    if not allowed_file(file.filename):
+        return None, None, (jsonify({'error': 'Invalid file type. Allowed: png, jpg, jpeg, bmp, tiff'}), 400)
     
-    return jsonify({'error': 'Invalid file type. Allowed: png, jpg, jpeg, bmp, tiff'}), 400
+    return file, model_type, None
+
+def predict_upload(buf, model_type):
+    """Return the softmax row for the raw upload bytes"""
+    # Identical uploads reuse the cached prediction
+    cache_key = (model_type, hashlib.sha256(buf).digest())
+    prediction = prediction_cache.get(cache_key)
+    if prediction is not None:
+        return prediction
+    
+    # Load appropriate model (shared with the batch worker)
+    get_model(model_type)
+    
+    # Decode and preprocess the in-memory upload in the decode pool
+    input_dtype = vgg16_input_dtype if model_type == 'vgg16' else np.float32
+    img_array = decode_upload(buf, model_type, input_dtype)
+    
+    # Make prediction (batched with other concurrent requests)
+    future = get_batcher(model_type).submit(img_array)
+    try:
+        prediction = future.result(timeout=PREDICT_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        # Free the batch slot if the worker has not picked the request up yet
+        future.cancel()
+        raise TimeoutError(f"{model_type.upper()} prediction timed out after {PREDICT_TIMEOUT_SECONDS:g}s")
+    prediction_cache.put(cache_key, prediction)
+    return prediction
+
+@app.route('/api/predict', methods=['POST'])
+def predict():
+    file, model_type, error = validate_upload()
+    if error is not None:
+        return error
+    
+    try:
+        prediction = predict_upload(file.stream.read(), model_type)
+        probs = prediction.tolist()
+        predicted_class_idx = int(np.argmax(prediction))
+        confidence = probs[predicted_class_idx]
+        
+        # Prepare response
+        result = {
+            'prediction': CLASS_NAMES[predicted_class_idx],
+            'confidence': confidence,
+            'class_index': predicted_class_idx,
+            'model_type': model_type,
+            'timestamp': current_timestamp(exact=wants_exact_timestamp()),
+            'all_predictions': dict(zip(CLASS_NAMES, probs))
+        }
+        
+        logger.info(f"Prediction ({model_type.upper()}): {result['prediction']} (Confidence: {confidence:.2f})")
+        return ojson(result)
+        
+    except Exception as e:
+        logger.error(f"Prediction error: {str(e)}")
+        return jsonify({'error': 'Prediction failed: ' + str(e)}), 500
+
+@app.route('/api/predict_raw', methods=['POST'])
+def predict_raw():
+    """Like /api/predict, but returns the probabilities (in CLASS_NAMES order) as packed little-endian float32"""
+    file, model_type, error = validate_upload()
+    if error is not None:
+        return error
+    
+    try:
+        prediction = predict_upload(file.stream.read(), model_type)
+        return Response(
+            prediction.astype('<f4').tobytes(),
+            mimetype='application/octet-stream',
+            headers={'X-Prediction-Index': str(int(np.argmax(prediction)))}
+        )
+    except Exception as e:
+        logger.error(f"Prediction error: {str(e)}")
+        return jsonify({'error': 'Prediction failed: ' + str(e)}), 500
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -298,7 +673,7 @@ def health_check():
             'vgg16_model_loaded': vgg16_model is not None,
             'cnn_status': cnn_status,
             'vgg16_status': vgg16_status,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': current_timestamp(exact=wants_exact_timestamp())
         })
     except Exception as e:
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
@@ -331,19 +706,48 @@ def get_metrics(model_type):
         'metrics': metrics
     })
 
-if __name__ == '__main__':
-    # Pre-load models on startup (optional - can be lazy loaded)
+def create_app():
+    """Pre-load and warm up both models and return the Flask app.
+    
+    For production, serve through gunicorn (see gunicorn.conf.py):
+    
+        gunicorn -c gunicorn.conf.py 'app:create_app()'
+    
+    gunicorn calls this in every worker after forking. Warmup runs real inference,
+    which starts TensorFlow/TFLite/OpenVINO thread pools, and those do not survive
+    a fork, so it must not run in the master. Sharing weights copy-on-write across
+    workers is therefore out of scope: serve with a single worker (the default), so
+    one copy of the models and one batcher see all the traffic. Never run the
+    production server with debug=True.
+    """
+    # Use get_model so the loads go through the same lock as lazy loading, and start
+    # the runtimes' thread pools on the compute cores
     try:
-        load_cnn_model()
+        get_model('cnn')
         logger.info("CNN model pre-loaded")
     except Exception as e:
         logger.warning(f"Could not pre-load CNN model: {str(e)}")
     
     try:
-        load_vgg16_model()
+        get_model('vgg16')
         logger.info("VGG16 model pre-loaded")
     except Exception as e:
         logger.warning(f"Could not pre-load VGG16 model: {str(e)}")
-    
+    return app
+
+def run_dev_server():
+    """Development server only; set FLASK_DEBUG=1 for the debugger"""
+    create_app()
+    # The single dev server process keeps its request threads on the I/O core
+    pin_current_thread(IO_CPUS)
     logger.info("Server starting...")
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # The debug reloader re-executes this module in a child process, importing
+    # TensorFlow and loading every model a second time; keep it disabled
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', use_reloader=False, host='0.0.0.0', port=5000)
+
+if __name__ == '__main__':
+    # Decode pool workers would re-import this script, and with it TensorFlow;
+    # `python serve.py` keeps them TensorFlow-free
+    logger.warning("Decode pool disabled when running app.py directly; use `python serve.py`")
+    DECODE_WORKERS = 0
+    run_dev_server()
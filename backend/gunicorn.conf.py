@@ -0,0 +1,27 @@
+"""Gunicorn settings for production serving.
+
+Run from the backend directory:
+
+    gunicorn -c gunicorn.conf.py 'app:create_app()'
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# One worker by default: TensorFlow cannot be shared copy-on-write across forked
+# workers, so every extra worker holds its own copy of the models and its own
+# batcher (splitting batches). app.py divides its TensorFlow and decode pools by
+# GUNICORN_WORKERS, so set that variable rather than --workers to change it.
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+
+# Threaded worker; enough request threads to fill several batches concurrently
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+# Do not preload: create_app() warms the models up by running inference, and the
+# thread pools that starts would be lost in the forked workers, hanging their first
+# prediction. Each worker calls create_app() itself after the fork.
+preload_app = False
+
+# Model loading and warmup can take well over gunicorn's default 30s
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
@@ -0,0 +1,321 @@
+"""Offline model optimization for the Flask backend.
+
+Run from the backend directory, e.g.:
+
+    python optimize_models.py openvino --calibration-dir data/calibration
+    python optimize_models.py saved-model
+    python optimize_models.py fp16
+    python optimize_models.py tflite --model all --calibration-dir data/calibration
+    python optimize_models.py prune-head --data-dir data/train --format openvino
+
+The generated artifacts are written next to the original models and are
+picked up by app.py on the next start. The INT8 TFLite and pruned models
+are only served when enabled with USE_CNN_TFLITE, USE_VGG16_TFLITE or
+USE_PRUNED_VGG16, and the INT8 models are skipped on GPU hosts.
+"""
+import os
+import json
+import argparse
+import logging
+import numpy as np
+from PIL import Image
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+
+from app import (
+    CLASS_NAMES, CNN_MODEL_PATH, CNN_TFLITE_PATH,
+    VGG16_MODEL_PATH, VGG16_SAVED_MODEL_PATH, VGG16_OPENVINO_PATH,
+    VGG16_FP16_SAVED_MODEL_PATH, VGG16_TFLITE_PATH,
+    VGG16_PRUNED_OPENVINO_PATH, VGG16_PRUNED_TFLITE_PATH, VGG16_PRUNED_METRICS_PATH, allowed_file,
+    OpenVINOModelWrapper, TFLiteModelWrapper
+)
+from preprocessing import preprocess_image
+
+# Source model and TFLite output per model type
+TFLITE_TARGETS = {
+    'cnn': (CNN_MODEL_PATH, CNN_TFLITE_PATH),
+    'vgg16': (VGG16_MODEL_PATH, VGG16_TFLITE_PATH),
+}
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def load_calibration_images(calibration_dir, model_type, limit=300, seed=42):
+    """Load up to `limit` images preprocessed exactly like /api/predict does"""
+    paths, groups = [], []
+    for root, dirs, files in os.walk(calibration_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if allowed_file(filename):
+                paths.append(os.path.join(root, filename))
+                groups.append(root)
+    if not paths:
+        raise RuntimeError(f"No calibration images found in {calibration_dir}")
+    if len(paths) > limit:
+        # Images are grouped by (class) sub-directory, so sample the same share of each
+        _, sample_idx = stratified_split(np.array(groups), limit / len(paths), seed)
+        paths = [paths[i] for i in sorted(sample_idx[:limit])]
+    return [preprocess_image(Image.open(path).convert('RGB'), model_type=model_type) for path in paths]
+
+def quantize_openvino_int8(keras_model, images, output_path):
+    """Convert a Keras model to OpenVINO IR and apply NNCF INT8 post-training quantization"""
+    import nncf
+    import openvino as ov
+
+    ov_model = ov.convert_model(keras_model)
+    quantized_model = nncf.quantize(ov_model, nncf.Dataset(images), subset_size=len(images))
+
+    ov.save_model(quantized_model, output_path)
+    logger.info(f"INT8 OpenVINO IR saved to {output_path}")
+
+def export_openvino_int8(args):
+    """Convert the VGG16 .h5 model to INT8 OpenVINO IR"""
+    keras_model = load_model(VGG16_MODEL_PATH, compile=False)
+    images = load_calibration_images(args.calibration_dir, 'vgg16', limit=args.subset_size)
+    logger.info(f"Quantizing VGG16 with {len(images)} calibration images...")
+    quantize_openvino_int8(keras_model, images, VGG16_OPENVINO_PATH)
+
+def export_saved_model(args):
+    """Re-export VGG16 as a SavedModel with a fixed float32 serving signature"""
+    keras_model = load_model(VGG16_MODEL_PATH, compile=False)
+
+    @tf.function(input_signature=[tf.TensorSpec([None, 224, 224, 3], tf.float32, name='input_1')])
+    def serve(input_1):
+        return {'output_0': keras_model(input_1, training=False)}
+
+    tf.saved_model.save(keras_model, VGG16_SAVED_MODEL_PATH, signatures={'serving_default': serve})
+    logger.info(f"SavedModel saved to {VGG16_SAVED_MODEL_PATH}")
+
+def to_mixed_precision_config(config, output_layer_name=None):
+    """Rewrite layer dtypes in a (possibly nested) model config for mixed precision, in place"""
+    for layer in config.get('layers', []):
+        layer_config = layer['config']
+        if layer['class_name'] == 'InputLayer':
+            # Accept the float16 signature input as-is instead of casting it back to float32
+            layer_config['dtype'] = 'float16'
+        elif 'layers' in layer_config:
+            # Nested model (e.g. the VGG16 base): from_config ignores an injected
+            # dtype there, so rewrite its own layers
+            to_mixed_precision_config(layer_config)
+        elif layer_config.get('name') == output_layer_name:
+            # Keep the softmax head in float32 for numerically stable probabilities
+            layer_config['dtype'] = 'float32'
+        else:
+            layer_config['dtype'] = 'mixed_float16'
+    return config
+
+def iter_layers(model):
+    """Yield every layer of a model, descending into nested models"""
+    for layer in model.layers:
+        yield layer
+        if isinstance(layer, tf.keras.Model):
+            yield from iter_layers(layer)
+
+def export_fp16_saved_model(args):
+    """Rebuild VGG16 under the mixed_float16 policy and export it as a float16-input SavedModel"""
+    fp32_model = load_model(VGG16_MODEL_PATH, compile=False)
+    config = to_mixed_precision_config(fp32_model.get_config(), fp32_model.layers[-1].name)
+
+    tf.keras.mixed_precision.set_global_policy('mixed_float16')
+    try:
+        fp16_model = fp32_model.__class__.from_config(config)
+    finally:
+        tf.keras.mixed_precision.set_global_policy('float32')
+    fp16_model.set_weights(fp32_model.get_weights())
+
+    # The conv stack carries nearly all the FLOPs; refuse to export if any of it stayed float32
+    float32_convs = [layer.name for layer in iter_layers(fp16_model)
+                     if isinstance(layer, tf.keras.layers.Conv2D) and layer.compute_dtype != 'float16']
+    if float32_convs:
+        raise RuntimeError(f"Conv layers not converted to float16: {float32_convs}")
+
+    @tf.function(input_signature=[tf.TensorSpec([None, 224, 224, 3], tf.float16, name='input_1')])
+    def serve(input_1):
+        return {'output_0': tf.cast(fp16_model(input_1, training=False), tf.float32)}
+
+    tf.saved_model.save(fp16_model, VGG16_FP16_SAVED_MODEL_PATH, signatures={'serving_default': serve})
+    logger.info(f"FP16 SavedModel saved to {VGG16_FP16_SAVED_MODEL_PATH}")
+
+def convert_tflite_int8(keras_model, images, output_path):
+    """Full-integer post-training quantization (INT8 weights, activations, input and output)"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = lambda: ([img] for img in images)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    logger.info(f"INT8 TFLite model saved to {output_path}")
+
+def export_tflite_int8(args):
+    """Convert the CNN and/or VGG16 .h5 models to INT8 TFLite"""
+    model_types = list(TFLITE_TARGETS) if args.model == 'all' else [args.model]
+    for model_type in model_types:
+        model_path, output_path = TFLITE_TARGETS[model_type]
+        keras_model = load_model(model_path, compile=False)
+        images = load_calibration_images(args.calibration_dir, model_type, limit=args.subset_size)
+        logger.info(f"Quantizing {model_type.upper()} with {len(images)} calibration images...")
+        convert_tflite_int8(keras_model, images, output_path)
+
+def list_labelled_images(data_dir):
+    """Return (image paths, labels) from one sub-directory per class"""
+    # Sorted directory order must match CLASS_NAMES, as with image_dataset_from_directory
+    class_dirs = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    if len(class_dirs) != len(CLASS_NAMES):
+        raise RuntimeError(f"Expected {len(CLASS_NAMES)} class directories in {data_dir}, found {len(class_dirs)}")
+    paths, labels = [], []
+    for label, class_dir in enumerate(class_dirs):
+        class_path = os.path.join(data_dir, class_dir)
+        for filename in sorted(os.listdir(class_path)):
+            if allowed_file(filename):
+                paths.append(os.path.join(class_path, filename))
+                labels.append(label)
+    return paths, np.array(labels)
+
+def iter_image_batches(paths, batch_size):
+    """Yield VGG16-preprocessed images from `paths` in batches of `batch_size`"""
+    for start in range(0, len(paths), batch_size):
+        yield np.concatenate([preprocess_image(Image.open(path).convert('RGB'), model_type='vgg16')
+                              for path in paths[start:start + batch_size]])
+
+def extract_vgg16_backbone(keras_model):
+    """Return the convolutional part (up to block5_pool) of the trained VGG16"""
+    for layer in keras_model.layers:
+        # VGG16 base nested as a single layer (include_top=False)
+        if isinstance(layer, tf.keras.Model):
+            return layer
+    return tf.keras.Model(keras_model.inputs, keras_model.get_layer('block5_pool').output)
+
+def stratified_split(labels, validation_fraction, seed):
+    """Shuffled train/validation indices holding out `validation_fraction` of every class"""
+    rng = np.random.default_rng(seed)
+    train_idx, val_idx = [], []
+    for label in np.unique(labels):
+        idx = rng.permutation(np.flatnonzero(labels == label))
+        n_val = max(1, int(round(len(idx) * validation_fraction)))
+        val_idx.extend(idx[:n_val])
+        train_idx.extend(idx[n_val:])
+    return rng.permutation(train_idx), rng.permutation(val_idx)
+
+def classification_metrics(y_true, y_pred):
+    """Accuracy and macro-averaged precision/recall/F1, keyed like the evaluation metrics JSON"""
+    precisions, recalls, f1s = [], [], []
+    for label in range(len(CLASS_NAMES)):
+        tp = np.sum((y_pred == label) & (y_true == label))
+        precision = tp / max(np.sum(y_pred == label), 1)
+        recall = tp / max(np.sum(y_true == label), 1)
+        precisions.append(precision)
+        recalls.append(recall)
+        f1s.append(2 * precision * recall / (precision + recall) if precision + recall else 0.0)
+    return {
+        'accuracy': float(np.mean(y_true == y_pred)),
+        'precision': float(np.mean(precisions)),
+        'recall': float(np.mean(recalls)),
+        'f1_score': float(np.mean(f1s)),
+        'validation_samples': int(len(y_true)),
+    }
+
+def export_pruned_vgg16(args):
+    """Replace the VGG16 FC stack with GlobalAveragePooling2D -> Dense(4) and export it as INT8"""
+    if args.format == 'openvino':
+        # Fail before any training if the quantization toolchain is missing
+        import nncf
+        import openvino
+
+    backbone = extract_vgg16_backbone(load_model(VGG16_MODEL_PATH, compile=False))
+    backbone.trainable = False
+    pooling = tf.keras.layers.GlobalAveragePooling2D()
+    feature_extractor = tf.keras.Model(backbone.inputs, pooling(backbone.outputs[0]))
+
+    # The backbone is frozen, so pooled features are computed once and the head trains on them
+    paths, labels = list_labelled_images(args.data_dir)
+    features = np.concatenate([feature_extractor.predict(batch, verbose=0)
+                               for batch in iter_image_batches(paths, args.batch_size)])
+    logger.info(f"Training pruned head on {len(labels)} images...")
+
+    head = tf.keras.layers.Dense(len(CLASS_NAMES), activation='softmax', name='pruned_head')
+    head_model = tf.keras.Sequential([tf.keras.Input(shape=features.shape[1:]), head])
+    head_model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    # Images arrive grouped by class, so hold out a stratified split instead of validation_split
+    train_idx, val_idx = stratified_split(labels, args.validation_fraction, args.seed)
+    head_model.fit(features[train_idx], labels[train_idx], epochs=args.epochs, shuffle=True,
+                   validation_data=(features[val_idx], labels[val_idx]))
+
+    pruned_model = tf.keras.Model(backbone.inputs, head(pooling(backbone.outputs[0])))
+    images = load_calibration_images(args.calibration_dir or args.data_dir, 'vgg16',
+                                     limit=args.subset_size, seed=args.seed)
+    logger.info(f"Quantizing pruned VGG16 with {len(images)} calibration images...")
+    if args.format == 'openvino':
+        quantize_openvino_int8(pruned_model, images, VGG16_PRUNED_OPENVINO_PATH)
+        description = 'pruned INT8 OpenVINO IR'
+        exported_model = OpenVINOModelWrapper(openvino.Core().compile_model(VGG16_PRUNED_OPENVINO_PATH, "CPU"))
+    else:
+        convert_tflite_int8(pruned_model, images, VGG16_PRUNED_TFLITE_PATH)
+        description = 'pruned INT8 TFLite model'
+        exported_model = TFLiteModelWrapper(VGG16_PRUNED_TFLITE_PATH)
+
+    # Served by /api/metrics/vgg16 while the pruned model is active, so evaluate the
+    # quantized artifact itself (through the same wrapper app.py serves it with)
+    val_paths = [paths[i] for i in val_idx]
+    val_pred = np.concatenate([np.argmax(exported_model.predict(batch, verbose=0), axis=1)
+                               for batch in iter_image_batches(val_paths, args.batch_size)])
+    metrics = classification_metrics(labels[val_idx], val_pred)
+    metrics['evaluated_model'] = description
+    with open(VGG16_PRUNED_METRICS_PATH, 'w') as f:
+        json.dump(metrics, f, indent=2)
+    logger.info(f"Pruned model validation metrics: {metrics}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    openvino_parser = subparsers.add_parser('openvino', help='Export VGG16 as INT8 OpenVINO IR')
+    openvino_parser.add_argument('--calibration-dir', required=True,
+                                 help='Directory of representative training images')
+    openvino_parser.add_argument('--subset-size', type=int, default=300,
+                                 help='Number of calibration images to use')
+    openvino_parser.set_defaults(func=export_openvino_int8)
+
+    saved_model_parser = subparsers.add_parser('saved-model',
+                                               help='Export VGG16 as a SavedModel with a fixed signature')
+    saved_model_parser.set_defaults(func=export_saved_model)
+
+    fp16_parser = subparsers.add_parser('fp16', help='Export VGG16 as a mixed-precision FP16 SavedModel')
+    fp16_parser.set_defaults(func=export_fp16_saved_model)
+
+    tflite_parser = subparsers.add_parser('tflite', help='Export models as INT8 TFLite')
+    tflite_parser.add_argument('--model', choices=['cnn', 'vgg16', 'all'], default='all',
+                               help='Which model to convert')
+    tflite_parser.add_argument('--calibration-dir', required=True,
+                               help='Directory of representative training images')
+    tflite_parser.add_argument('--subset-size', type=int, default=300,
+                               help='Number of calibration images to use')
+    tflite_parser.set_defaults(func=export_tflite_int8)
+
+    prune_parser = subparsers.add_parser('prune-head',
+                                         help='Export VGG16 with a GAP + Dense head as INT8')
+    prune_parser.add_argument('--data-dir', required=True,
+                              help='Training images, one sub-directory per class (sorted like CLASS_NAMES)')
+    prune_parser.add_argument('--format', choices=['openvino', 'tflite'], default='openvino',
+                              help='Runtime format of the quantized model')
+    prune_parser.add_argument('--epochs', type=int, default=20,
+                              help='Epochs for training the new head')
+    prune_parser.add_argument('--batch-size', type=int, default=32,
+                              help='Batch size for feature extraction')
+    prune_parser.add_argument('--validation-fraction', type=float, default=0.1,
+                              help='Fraction of each class held out for validation')
+    prune_parser.add_argument('--seed', type=int, default=42,
+                              help='Seed for the train/validation split')
+    prune_parser.add_argument('--calibration-dir',
+                              help='Calibration images (defaults to --data-dir)')
+    prune_parser.add_argument('--subset-size', type=int, default=300,
+                              help='Number of calibration images to use')
+    prune_parser.set_defaults(func=export_pruned_vgg16)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
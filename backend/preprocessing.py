@@ -0,0 +1,30 @@
+"""Image decoding and preprocessing shared by app.py and optimize_models.py.
+
+This module must not import TensorFlow: it is preloaded by the decode
+process pool workers, which only need PIL and NumPy.
+"""
+import io
+import numpy as np
+from PIL import Image
+
+# ImageNet BGR channel means used by VGG16 ('caffe' style) preprocessing
+VGG16_BGR_MEAN = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+def preprocess_image(img, model_type='vgg16', target_size=(224, 224), dtype=np.float32):
+    """Preprocess image based on model type"""
+    img_array = np.asarray(img.resize(target_size, Image.BILINEAR), dtype=np.float32)
+
+    if model_type == 'vgg16':
+        # VGG16 requires specific preprocessing: RGB -> BGR, then subtract ImageNet means
+        img_array = img_array[..., ::-1]
+        img_array -= VGG16_BGR_MEAN
+    else:
+        # CNN (and default) normalization to [0, 1]
+        img_array *= 1.0 / 255.0
+
+    return img_array[np.newaxis, ...].astype(dtype, copy=False)
+
+def decode_and_preprocess(buf, model_type='vgg16', dtype=np.float32):
+    """Decode raw upload bytes and preprocess them (runs in the decode process pool)"""
+    img = Image.open(io.BytesIO(buf)).convert('RGB')
+    return preprocess_image(img, model_type=model_type, dtype=dtype)
@@ -0,0 +1,9 @@
+"""Development server entry point: python serve.py
+
+app is imported only inside the __main__ guard. Decode pool workers re-import
+this script, not app.py, so they stay free of TensorFlow.
+"""
+
+if __name__ == '__main__':
+    import app
+    app.run_dev_server()